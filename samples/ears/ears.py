@@ -4,7 +4,21 @@ import json
 import datetime
 import numpy as np
 import skimage.draw
-import glob
+import tensorflow as tf
+import keras
+from tensorflow.core.protobuf import rewriter_config_pb2
+import subprocess
+import zipfile
+import collections
+import concurrent.futures
+import cv2
+from PIL import Image
+
+# Numba is optional. Without it color_splash() falls back to NumPy.
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # Root directory of the project
 ROOT_DIR = os.path.abspath("../../")
@@ -47,10 +61,173 @@ class EarConfig(Config):
     # Supported values are: resnet50, resnet101
     #BACKBONE = "resnet50"
 
+
+class InferenceConfig(EarConfig):
+    # Set batch size to 1 since we'll be running inference on
+    # one image at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
+    GPU_COUNT = 1
+    IMAGES_PER_GPU = 1
+
+
+class AutoBatchConfig(EarConfig):
+    """EarConfig with IMAGES_PER_GPU chosen at run time, e.g. by
+    auto_images_per_gpu().
+    """
+    def __init__(self, images_per_gpu):
+        # Set before Config.__init__() derives BATCH_SIZE from it
+        self.IMAGES_PER_GPU = images_per_gpu
+        super(AutoBatchConfig, self).__init__()
+
 ###############################
 ## Dataset 
 ###############################
 
+# Name of the file, stored in the dataset root directory, that caches the
+# listing and image dimensions of a subset between runs. {} is the subset.
+DATASET_CACHE_NAME = ".earcache_{}.json"
+
+# Extensions of the files load_ear() treats as images
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+# Directory, in the dataset root directory next to the dataset cache,
+# where build_cache() writes the packed masks of a subset. It's kept out of
+# the annotations directory so creating it doesn't change that directory's
+# mtime and invalidate the cached listing. {} is the subset.
+MASK_CACHE_DIR = ".earmasks_{}"
+
+# Number of threads used to read image headers in load_ear() and mask
+# files in build_cache()
+PROBE_WORKERS = 16
+
+
+def load_dataset_cache(cache_path):
+    """Load a dataset cache written by save_dataset_cache().
+    Returns a dict with the "image_dir_mtime" and "mask_dir_mtime" of the
+    listing and "images", a dict of image filename -> {"mtime", "width",
+    "height", "files"}. An empty dict is returned if the cache doesn't exist
+    or can't be read, or isn't laid out that way.
+    """
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    # The cache is only an optimization, so anything unexpected means a
+    # rescan rather than an error in load_ear()
+    if not isinstance(cache, dict) or not isinstance(cache.get("images"), dict):
+        return {}
+    for entry in cache["images"].values():
+        if (not isinstance(entry, dict) or
+                not all(k in entry for k in ("mtime", "width", "height")) or
+                not isinstance(entry.get("files"), list)):
+            return {}
+    return cache
+
+
+def save_dataset_cache(cache_path, cache):
+    """Write a dataset cache. Failures are ignored since the cache is only
+    an optimization (e.g. read-only dataset).
+    """
+    try:
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+    except (IOError, OSError):
+        pass
+
+
+def image_size(image_path):
+    """Return (height, width) of an image without decoding its pixels.
+    PIL only parses the file header on open.
+    """
+    with Image.open(image_path) as im:
+        width, height = im.size
+    return height, width
+
+
+def probe_image(image_path, cached=None):
+    """Return the dimensions of an image as {"mtime", "width", "height"}.
+    cached: A previous result for the same file. It's returned as is if the
+        file hasn't been modified since.
+    """
+    mtime = os.path.getmtime(image_path)
+    if cached and cached["mtime"] == mtime:
+        return cached
+    height, width = image_size(image_path)
+    return {"mtime": mtime, "width": width, "height": height}
+
+
+def read_mask(mask_path):
+    """Read a mask file as a [height, width] bool array that is set
+    wherever the file is nonzero, in any channel and at any bit depth.
+    Uses OpenCV, which decodes PNG and TIFF natively, rather than going
+    through the skimage.io plugin dispatch on every call.
+    """
+    # IMREAD_UNCHANGED keeps 16-bit masks and all channels. Grayscale mode
+    # would scale 16-bit values down to 8 bits and luma-weight colors, and
+    # both can turn small nonzero labels into 0.
+    m = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
+    if m is None:
+        raise IOError("Could not read mask file {}".format(mask_path))
+    m = m != 0
+    if m.ndim == 3:
+        m = m.any(axis=-1)
+    return m
+
+
+def index_mask_files(mask_dir):
+    """Group the mask files of a directory by the image they belong to.
+    Mask files are named <image>_<instance>.<ext>, where instance is a
+    single character (the '_?.*' glob pattern).
+
+    Returns a dict of image name (without extension) -> sorted list of
+    mask file paths.
+    """
+    index = {}
+    if not os.path.isdir(mask_dir):
+        return index
+    with os.scandir(mask_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith("."):
+                continue
+            # Any '_' followed by one character and a '.' may end the prefix
+            for i in range(len(name) - 2):
+                if name[i] == "_" and name[i + 2] == ".":
+                    index.setdefault(name[:i], []).append(entry.path)
+    for files in index.values():
+        files.sort()
+    return index
+
+
+def mask_names(files):
+    """Return the file names of a list of mask file paths."""
+    return [os.path.basename(f) for f in files]
+
+
+def mask_mtimes(files):
+    """Return the modification times of a list of mask file paths."""
+    return [os.path.getmtime(f) for f in files]
+
+
+def pack_masks(mask):
+    """Bit-pack a [height, width, instance count] bool mask array along the
+    instance axis. Returns a uint8 array of shape
+    [height, width, ceil(instance count / 8)]. See unpack_masks().
+    """
+    return np.packbits(mask, axis=-1)
+
+
+def unpack_masks(packed, count):
+    """Unpack masks packed by pack_masks().
+    count: Number of instances, which the packed array can't tell apart
+        from padding bits.
+
+    Returns a bool array of shape [height, width, count].
+    """
+    # Unpacked values are 0/1, so viewing them as bool is safe
+    return np.unpackbits(packed, axis=-1, count=count).view(bool)
+
+
 class EarDataset(utils.Dataset):
 
     def load_ear(self, dataset_dir, subset):
@@ -65,28 +242,171 @@ class EarDataset(utils.Dataset):
         # Assert folders train and test in dataset path
         assert subset in ["train", "test"]
         annotation = subset + 'annot'
+        root_dir = dataset_dir
         mask_dir = os.path.join(dataset_dir, annotation)
+        cache_dir = os.path.join(root_dir, MASK_CACHE_DIR.format(subset))
         dataset_dir = os.path.join(dataset_dir, subset)        
         
-        images = []
-        for (dirpath, dirnames, filenames) in os.walk(dataset_dir):    
-            images.extend(filenames)       
-            break
-                
-        for filename in images:
-            image_path = os.path.join(dataset_dir, filename)
-            mask_path = os.path.join(mask_dir, filename)
-            img = skimage.io.imread(image_path)
-            height, width = img.shape[:2]            
+        # Listing and image dimensions cached from previous runs. Adding or
+        # removing files changes the mtime of their directory, so the
+        # listing is reused as long as both directory mtimes match. Image
+        # dimensions are reused per file if the file hasn't been modified.
+        cache_path = os.path.join(root_dir, DATASET_CACHE_NAME.format(subset))
+        cache = load_dataset_cache(cache_path)
+        image_dir_mtime = os.path.getmtime(dataset_dir)
+        mask_dir_mtime = (os.path.getmtime(mask_dir)
+                          if os.path.isdir(mask_dir) else None)
+        cached_images = cache.get("images", {})
+        listing_valid = (cache.get("image_dir_mtime") == image_dir_mtime and
+                         cache.get("mask_dir_mtime") == mask_dir_mtime)
+
+        if listing_valid:
+            images = list(cached_images)
+            mask_files = [cached_images[f]["files"] for f in images]
+        else:
+            # Only the top level is listed, and DirEntry.is_file() doesn't
+            # need an extra stat call on most platforms.
+            with os.scandir(dataset_dir) as it:
+                images = [e.name for e in it
+                          if e.is_file() and not e.name.startswith(".") and
+                          e.name.lower().endswith(IMAGE_EXTENSIONS)]
+            # List the mask files once here, so load_mask() doesn't have to
+            # glob the annotations directory for every sample.
+            mask_index = index_mask_files(mask_dir)
+            mask_files = [
+                [os.path.basename(path) for path in
+                 mask_index.get(os.path.splitext(f)[0], [])]
+                for f in images]
+        image_paths = [os.path.join(dataset_dir, f) for f in images]
+
+        # Probing is bound by file system latency, so overlap it in threads.
+        # Results come back in input order, which keeps image_info stable.
+        cached = [cached_images.get(f) for f in images]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=PROBE_WORKERS) as executor:
+            dims = list(executor.map(probe_image, image_paths, cached))
+
+        cache_changed = not listing_valid
+        new_images = {}
+        for filename, image_path, d, files in zip(
+                images, image_paths, dims, mask_files):
+            if d is not cached_images.get(filename):
+                cache_changed = True
+            new_images[filename] = dict(d, files=files)
+            image_id = os.path.splitext(filename)[0]
             self.add_image(
                 "ear",
-                image_id=os.path.splitext(filename)[0],
+                image_id=image_id,
                 path=image_path,
-                width=width, 
-                height=height,
-                mask=mask_path #original mask
+                width=d["width"],
+                height=d["height"],
+                mask=os.path.join(mask_dir, filename), #original mask
+                files=[os.path.join(mask_dir, f) for f in files],
+                mask_cache=os.path.join(cache_dir, image_id + ".npz")
             )
-        
+
+        if cache_changed:
+            save_dataset_cache(cache_path, {
+                "image_dir_mtime": image_dir_mtime,
+                "mask_dir_mtime": mask_dir_mtime,
+                "images": new_images,
+            })
+
+    def read_mask_files(self, image_id):
+        """Read the instance masks of an image from its per-instance
+        mask files.
+        Returns a bool array of shape [height, width, instance count].
+        """
+        # Mask file paths, as listed by load_ear()
+        info = self.image_info[image_id]
+        files = info["files"]
+
+        # Read mask files from .png image straight into a pre-allocated
+        # array instead of stacking a list of masks (which copies them all).
+        # Masks have the size of their image, which load_ear() already
+        # read from the image header.
+        mask = np.empty([info["height"], info["width"], len(files)],
+                        dtype=bool)
+        for i, mask_path in enumerate(files):
+            mask[:, :, i] = read_mask(mask_path)
+        return mask
+
+    def read_mask_cache(self, image_id):
+        """Read the packed masks of an ear image written by build_cache().
+        Returns (packed, count) as in pack_masks(), or None if the cache file
+        is missing, unreadable, or was built from different mask files than
+        the ones load_ear() listed (by name and mtime).
+        """
+        info = self.image_info[image_id]
+        try:
+            with np.load(info["mask_cache"]) as data:
+                if (list(data["names"]) != mask_names(info["files"]) or
+                        list(data["mtimes"]) != mask_mtimes(info["files"])):
+                    return None
+                return data["packed"], int(data["shape"][-1])
+        except (IOError, OSError, EOFError, ValueError, KeyError, TypeError,
+                AttributeError, IndexError, zipfile.BadZipFile):
+            # Missing, truncated (np.load raises EOFError on an empty file)
+            # or not laid out the way write_mask_cache() writes it
+            return None
+
+    def write_mask_cache(self, image_id, mask):
+        """Write the packed masks of an ear image to its cache file.
+        The file is written under a temporary name and then moved into
+        place, so an interrupted build never leaves a truncated cache file.
+        """
+        info = self.image_info[image_id]
+        tmp_path = info["mask_cache"] + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, packed=pack_masks(mask),
+                         shape=np.array(mask.shape),
+                         names=np.array(mask_names(info["files"]), dtype=str),
+                         mtimes=np.array(mask_mtimes(info["files"]),
+                                         dtype=np.float64))
+            os.replace(tmp_path, info["mask_cache"])
+        except BaseException:
+            # Don't leave a partial .tmp file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def build_cache(self):
+        """Pack the masks of every ear image into one .npz file per image.
+        Masks are bit-packed along the instance axis, so load_mask() gets
+        them with a single read instead of one decode per instance. Images
+        with an up to date cache file are skipped. The names and mtimes of
+        the mask files are stored with the masks, so editing, adding or
+        removing a mask file rebuilds that image's cache.
+        """
+        image_ids = [i for i, info in enumerate(self.image_info)
+                     if info["source"] == "ear" and
+                     self.read_mask_cache(i) is None]
+        if not image_ids:
+            return
+        cache_dirs = {os.path.dirname(self.image_info[i]["mask_cache"])
+                      for i in image_ids}
+        for d in cache_dirs:
+            os.makedirs(d, exist_ok=True)
+
+        # Reading and decoding the mask files is I/O bound and OpenCV
+        # releases the GIL, so the masks of the next images are read by
+        # the pool while the current ones are packed and written. At most
+        # 2 * PROBE_WORKERS images are read ahead, which bounds the memory
+        # held by unpacked masks waiting to be written.
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=PROBE_WORKERS) as executor:
+            for image_id in image_ids:
+                pending.append((image_id, executor.submit(
+                    self.read_mask_files, image_id)))
+                if len(pending) >= 2 * PROBE_WORKERS:
+                    done_id, future = pending.popleft()
+                    self.write_mask_cache(done_id, future.result())
+            while pending:
+                done_id, future = pending.popleft()
+                self.write_mask_cache(done_id, future.result())
+
     def load_mask(self, image_id):
         """Generate instance masks for an image.
         Returns:
@@ -98,23 +418,15 @@ class EarDataset(utils.Dataset):
         image_info = self.image_info[image_id]
         if image_info["source"] != "ear":
             return super(self.__class__, self).load_mask(image_id)
-        
-        #mask = np.zeros([info["height"], info["width"], (#number_instances)], dtype=np.uint8)
-        # Get a mask per instance        
-        info = self.image_info[image_id]
-        mask_root = os.path.splitext(info["mask"])[0]              
-        parent = os.path.dirname(info["mask"])
-        files = glob.glob(mask_root+'_?.*')        
-        
-        # Read mask files from .png image
-        #return len(files), mask_root, parent
-        mask = []        
-        for i in range (0,len(files)):
-            mask_path = os.path.join(parent, files[i])            
-            m = skimage.io.imread(mask_path).astype(np.bool)
-            mask.append(m)   
-    
-        mask = np.stack(mask, axis=-1)
+
+        # Use the packed masks written by build_cache() if they're up to
+        # date, otherwise read a mask per instance.
+        cached = self.read_mask_cache(image_id)
+        if cached is not None:
+            mask = unpack_masks(*cached)
+        else:
+            mask = self.read_mask_files(image_id)
+
         # Return mask, and array of class IDs of each instance. Since we have
         # one class ID only, we return an array of 1s
         return mask, np.ones([mask.shape[-1]], dtype=np.int32)
@@ -131,17 +443,97 @@ class EarDataset(utils.Dataset):
 ## Training
 ###############################
 
+def configure_session(mixed_precision=False):
+    """Set the Keras session to use TensorFlow's graph rewrites for speed
+    and memory.
+    mixed_precision: If True, let the automatic mixed precision pass run
+        eligible ops (mostly the backbone convolutions) in float16 on
+        Tensor Core GPUs. Has no effect on CPUs. This rewrite only inserts
+        casts and doesn't add loss scaling, so small gradients can underflow
+        in float16 during training. Off by default.
+
+    Also enables recomputation of cheap activations in the backward pass
+    to reduce peak GPU memory. Options the installed TensorFlow doesn't
+    know about are skipped.
+    """
+    session_config = tf.ConfigProto()
+    rewrite_options = session_config.graph_options.rewrite_options
+    RewriterConfig = rewriter_config_pb2.RewriterConfig
+    if mixed_precision and hasattr(rewrite_options, "auto_mixed_precision"):
+        rewrite_options.auto_mixed_precision = RewriterConfig.ON
+    if hasattr(RewriterConfig, "RECOMPUTATION_HEURISTICS"):
+        rewrite_options.memory_optimization = \
+            RewriterConfig.RECOMPUTATION_HEURISTICS
+    keras.backend.set_session(tf.Session(config=session_config))
+
+# Training memory needed per 1024x1024 image (activations, gradients and
+# their share of the weights). Matches the rule of thumb in Config that a
+# 12GB GPU can handle 2 images with the memory fraction below.
+TRAIN_MEMORY_PER_IMAGE = 3.5 * 1024 ** 3
+
+# Fraction of the free GPU memory auto_images_per_gpu() may plan to use
+AUTO_BATCH_MEMORY_FRACTION = 0.6
+
+def gpu_free_memory():
+    """Return the free memory in bytes of each GPU visible to this process,
+    as reported by nvidia-smi, or an empty list if there are no NVIDIA GPUs
+    or the output can't be parsed.
+    """
+    command = ["nvidia-smi", "--query-gpu=memory.free",
+               "--format=csv,noheader,nounits"]
+    # nvidia-smi lists every physical GPU, so restrict it to the ones
+    # CUDA_VISIBLE_DEVICES exposes to TensorFlow.
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        if not visible.strip():
+            return []
+        command.append("--id=" + visible)
+    try:
+        output = subprocess.check_output(command)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    try:
+        # Values like "[N/A]" or "[Not Supported]" mean no usable reading
+        return [int(line) * 1024 ** 2
+                for line in output.decode().splitlines() if line.strip()]
+    except ValueError:
+        return []
+
+def auto_images_per_gpu(config, candidates=(1, 2, 4, 8)):
+    """Pick the largest IMAGES_PER_GPU that fits in the free GPU memory.
+    config: The training configuration. Its IMAGE_SHAPE sets the size of
+        the training images.
+    candidates: Batch sizes to choose from.
+
+    The graph is built with a fixed batch size, so instead of probing by
+    building the model once per candidate, the memory of each candidate is
+    estimated from TRAIN_MEMORY_PER_IMAGE scaled to the image size.
+
+    Returns config.IMAGES_PER_GPU unchanged if no GPU is found or its free
+    memory can't be read.
+    """
+    free = gpu_free_memory()[:config.GPU_COUNT]
+    if not free:
+        return config.IMAGES_PER_GPU
+    budget = min(free) * AUTO_BATCH_MEMORY_FRACTION
+    scale = float(config.IMAGE_SHAPE[0] * config.IMAGE_SHAPE[1]) / 1024 ** 2
+    per_image = TRAIN_MEMORY_PER_IMAGE * scale
+    fits = [n for n in candidates if n * per_image <= budget]
+    return max(fits) if fits else min(candidates)
+
 def train(model):
     """Train the model."""
     # Training dataset.
     dataset_train = EarDataset()
     dataset_train.load_ear(args.dataset, "train")
     dataset_train.prepare()
+    dataset_train.build_cache()
 
     # Validation dataset
     dataset_val = EarDataset()
     dataset_val.load_ear(args.dataset, "test")
     dataset_val.prepare()
+    dataset_val.build_cache()
 
     # *** This training schedule is an example. Update to your needs ***
     # Since we're using a very small dataset, and starting from
@@ -153,6 +545,51 @@ def train(model):
                 epochs=30,
                 layers='heads')
 
+def grayscale(image):
+    """Convert an RGB uint8 image to grayscale.
+    Uses the same luminance weights as skimage.color.rgb2gray, in 8.8 fixed
+    point, so no float64 copies of the image are made.
+
+    Returns a uint8 array of shape [height, width].
+    """
+    # Accumulate the weighted channels in place in a single uint16 buffer
+    # (8-bit values times 8-bit weights can't overflow it).
+    gray = np.empty(image.shape[:2], dtype=np.uint16)
+    tmp = np.empty_like(gray)
+    np.multiply(image[:, :, 0], 54, out=gray, dtype=np.uint16)
+    np.multiply(image[:, :, 1], 183, out=tmp, dtype=np.uint16)
+    gray += tmp
+    np.multiply(image[:, :, 2], 19, out=tmp, dtype=np.uint16)
+    gray += tmp
+    gray >>= 8
+    return gray.astype(np.uint8)
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _splash(image, any_mask, out):
+        """Fused color splash kernel. Writes to out the image where any_mask
+        is set, and its grayscale (see grayscale()) everywhere else.
+        """
+        for i in numba.prange(image.shape[0]):
+            for j in range(image.shape[1]):
+                if any_mask[i, j]:
+                    out[i, j, 0] = image[i, j, 0]
+                    out[i, j, 1] = image[i, j, 1]
+                    out[i, j, 2] = image[i, j, 2]
+                else:
+                    g = (54 * np.uint16(image[i, j, 0]) +
+                         183 * np.uint16(image[i, j, 1]) +
+                         19 * np.uint16(image[i, j, 2])) >> 8
+                    out[i, j, 0] = g
+                    out[i, j, 1] = g
+                    out[i, j, 2] = g
+
+    # Compile the kernel now rather than on the first splash
+    _splash(np.zeros((1, 1, 3), np.uint8), np.zeros((1, 1), np.bool_),
+            np.empty((1, 1, 3), np.uint8))
+else:
+    _splash = None
+
 def color_splash(image, mask):
     """Apply color splash effect.
     image: RGB image [height, width, 3]
@@ -160,27 +597,56 @@ def color_splash(image, mask):
 
     Returns result image.
     """
-    # Make a grayscale copy of the image. The grayscale copy still
-    # has 3 RGB channels, though.
-    gray = skimage.color.gray2rgb(skimage.color.rgb2gray(image)) * 255
-    # Copy color pixels from the original color image where mask is set
-    if mask.shape[-1] > 0:
-        # We're treating all instances as one, so collapse the mask into one layer
-        mask = (np.sum(mask, -1, keepdims=True) >= 1)
-        splash = np.where(mask, image, gray).astype(np.uint8)
-    else:
-        splash = gray.astype(np.uint8)
+    # The grayscale and splash kernels work in uint8 fixed point. Images
+    # that are already uint8 are passed through without a copy.
+    image = skimage.img_as_ubyte(image)
+    splash = np.empty(image.shape, dtype=np.uint8)
+
+    # We're treating all instances as one, so collapse the mask into one layer
+    any_mask = mask.any(axis=-1) if mask.shape[-1] > 0 else None
+    if any_mask is None or not any_mask.any():
+        # Nothing detected: the whole image is gray. The grayscale copy
+        # still has 3 RGB channels, though.
+        splash[...] = grayscale(image)[:, :, np.newaxis]
+        return splash
+    if any_mask.all():
+        # Everything is covered: the gray copy would never be used
+        return image.copy()
+
+    if _splash is not None:
+        _splash(image, any_mask, splash)
+        return splash
+
+    # Only compute the grayscale inside the bounding box of the pixels
+    # that aren't covered by the mask and take the rest from the image.
+    rows = np.flatnonzero(~any_mask.all(axis=1))
+    cols = np.flatnonzero(~any_mask.all(axis=0))
+    y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    splash[...] = image
+    window = splash[y1:y2, x1:x2]
+    gray = grayscale(image[y1:y2, x1:x2])[:, :, np.newaxis]
+    # Copy gray pixels where the mask isn't set
+    np.copyto(window, gray, where=~any_mask[y1:y2, x1:x2, np.newaxis])
     return splash
 
-def detect(model, image_path=None, video_path=None):
-    assert image_path or video_path
+def detect(model, image_path=None, video_path=None, image=None):
+    """Run detection on an image and save its color splash.
+    image_path: Path or URL of the image.
+    image: The image as an RGB array. If given, image_path is only used
+        for logging and the file isn't read again, which saves a decode
+        when the caller already has the pixels (e.g. looping over frames).
+
+    Returns the file name of the saved splash, or None.
+    """
+    assert image_path or video_path or image is not None
 
     # Image or video?
-    if image_path:
+    if image_path or image is not None:
         # Run model detection and generate the color splash effect
-        print("Running on {}".format(args.image))
+        print("Running on {}".format(image_path or "image array"))
         # Read image
-        image = skimage.io.imread(args.image)
+        if image is None:
+            image = skimage.io.imread(image_path)
         # Detect objects
         r = model.detect([image], verbose=1)[0]
         # Color splash
@@ -190,7 +656,9 @@ def detect(model, image_path=None, video_path=None):
         skimage.io.imsave(file_name, splash)
     else:
         print("Video option not supported")
+        return None
     print("Save to ", file_name)
+    return file_name
 ############################################################
 #  Training
 ############################################################
@@ -220,6 +688,15 @@ if __name__ == '__main__':
     parser.add_argument('--video', required=False,
                         metavar="path or URL to video",
                         help='Video to evaluate')
+    parser.add_argument('--mixed-precision', required=False,
+                        action='store_true',
+                        help='Run eligible ops in float16 (no loss scaling)')
+    parser.add_argument('--auto-batch', required=False,
+                        action='store_true',
+                        help='Choose IMAGES_PER_GPU from the free GPU memory')
+    parser.add_argument('--quiet', required=False,
+                        action='store_true',
+                        help="Don't print the configuration")
     args = parser.parse_args()
 
     # Validate arguments
@@ -236,16 +713,17 @@ if __name__ == '__main__':
     # Configurations
     if args.command == "train":
         config = EarConfig()
+        if args.auto_batch:
+            config = AutoBatchConfig(auto_images_per_gpu(config))
+            print("Auto batch: {} images per GPU".format(
+                config.IMAGES_PER_GPU))
     else:
-        class InferenceConfig(EarConfig):
-            # Set batch size to 1 since we'll be running inference on
-            # one image at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
-            GPU_COUNT = 1
-            IMAGES_PER_GPU = 1
         config = InferenceConfig()
-    config.display()
+    if not args.quiet:
+        config.display()
 
     # Create model
+    configure_session(mixed_precision=args.mixed_precision)
     if args.command == "train":
         model = modellib.MaskRCNN(mode="training", config=config, model_dir=args.logs)
     else: